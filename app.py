@@ -9,120 +9,662 @@
 # Licence:     GPL V3
 #-------------------------------------------------------------------------------
 
-import io
 import os
-import ast
-import json
+import glob
+import hashlib
+import functools
+import logging
 import datetime as dt
 import dateutil
 import dateutil.relativedelta
 import requests
+import requests_cache
+import tenacity
+import urllib3
+import concurrent.futures
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import folium
 import streamlit as st
 
+from folium.elements import JSCSSMixin
+from folium.map import Layer
 from streamlit_folium import st_folium
+from streamlit.runtime.uploaded_file_manager import UploadedFile
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from requests.adapters import HTTPAdapter
 
 import branca as bc
+import shapely
+
+from shapely import geos_version
+from shapely.geometry import box
+
+# journal des erreurs non bloquantes de l'application
+logger = logging.getLogger(__name__)
 
 # dossier racine où se trouvent les données récupérées et à présenter
 Racine = "./donnees"
 
+# durée de validité du cache des données téléchargées (en secondes)
+DUREE_CACHE = 3600
+
+
+# union des polygones découpés par les tuiles : CoverageUnion de GEOS (>= 3.12)
+# bien plus rapide que UnaryUnion, mais seulement sur une couverture valide,
+# vérifiée avec coverage_is_valid (shapely >= 2.1)
+FUSION_COUVERTURE = geos_version >= (3, 12, 0) and hasattr(shapely, "coverage_is_valid")
+
+# URL stable de la couche des zones d'arrêtés
+#URL_ZONES_ARRETES = "https://www.data.gouv.fr/fr/datasets/r/bfba7898-aed3-40ec-aa74-abb73b92a363"
+# URL stable de la couche au format PMTiles
+URL_ZONES_ARRETES = "https://object.files.data.gouv.fr/hydra-pmtiles/hydra-pmtiles/bfba7898-aed3-40ec-aa74-abb73b92a363.pmtiles"
+
+# bibliothèque javascript d'affichage des tuiles PMTiles dans Leaflet
+URL_PROTOMAPS_LEAFLET = "https://unpkg.com/protomaps-leaflet@4/dist/protomaps-leaflet.js"
+
+# tolérance de simplification des départements affichés (en degrés, ~500 m)
+TOLERANCE_DEPARTEMENTS = 0.005
+
+# tolérance de simplification des itinéraires affichés (en degrés, ~100 m)
+TOLERANCE_ITINERAIRE = 0.001
+
+# tolérance de simplification des zones d'arrêtés affichées (en degrés, ~200 m)
+TOLERANCE_ZONES = 0.002
+
+# colonnes utilisées des zones d'arrêtés (hors géométrie) et des archives des arrêtés
+COLONNES_ZONES = ['type', 'id', 'departement', 'niveauGravite', 'arreteRestriction']
+COLONNES_ARRETES = ['date_debut', 'date_fin', 'departement',
+                    'zones_alerte.niveau_gravite', 'zones_alerte.type']
+
+# niveaux de gravité des arrêtés, du moins au plus grave : type ordonné commun
+# aux zones et aux archives (comparaisons et regroupements sur des codes entiers)
+NIVEAUX_GRAVITE = pd.CategoricalDtype(["vigilance", "alerte", "alerte_renforcee", "crise"],
+                                      ordered=True)
+
+# délai maximal d'attente des archives des arrêtés téléchargées en tâche de fond (en secondes)
+DELAI_ARRETES = 30
+
+# délai maximal d'attente des zones d'arrêtés lues en tâche de fond (en secondes)
+DELAI_ZONES = 180
+
+# délais de connexion et de lecture des requêtes HTTP (en secondes) : un serveur
+# qui ne répond plus lève une erreur au lieu de bloquer le thread indéfiniment
+DELAI_HTTP = (10, 60)
+
+# nouvelles tentatives des requêtes HTTP en échec, avec attente croissante entre elles
+# (1 s, 2 s...), avant de renvoyer l'erreur. Seules les erreurs réseau (y compris
+# en cours de lecture d'une réponse reçue au fil de l'eau) et les erreurs serveur (5xx)
+# sont retentées : une erreur client (4xx) se reproduirait à l'identique
+reessayer = tenacity.retry(retry=(tenacity.retry_if_exception_type((requests.RequestException,
+                                                                    urllib3.exceptions.HTTPError))
+                                  & tenacity.retry_if_exception(
+                                      lambda e: not (isinstance(e, requests.HTTPError)
+                                                     and e.response is not None
+                                                     and e.response.status_code < 500))),
+                           stop=tenacity.stop_after_attempt(3),
+                           wait=tenacity.wait_exponential(multiplier=1, max=10),
+                           reraise=True)
+
+# version du format des sauvegardes parquet, portée par leur nom de fichier :
+# à incrémenter quand le contenu sauvegardé change (colonnes, types...),
+# les sauvegardes d'une autre version ne sont alors plus relues
+VERSION_SAUVEGARDE = 2
+
+# CRS commun à toutes les couches (WGS 84), celui de l'affichage folium
+CRS_CARTE = "EPSG:4326"
+
+# emprise de la métropole (en WGS 84) pour limiter la lecture des zones
+EMPRISE_METROPOLE = gpd.GeoSeries([box(-5.5, 41.0, 10.0, 51.5)], crs=CRS_CARTE)
+
+#-------------------------------------------------------------------------------
+
+def _cle_fichier(uploaded_file):
+    """Clé de cache d'un fichier téléchargé, sans relecture de son contenu.
+    L'identifiant attribué par Streamlit change à chaque nouveau téléchargement,
+    même pour un fichier de même nom.
+
+    Args:
+        uploaded_file (UploadedFile): fichier téléchargé
+
+    Returns:
+        tuple: identifiant et taille du fichier
+    """
+    return (uploaded_file.file_id, uploaded_file.size)
+
+#-------------------------------------------------------------------------------
+
+def _cle_gdf(gdf):
+    """Clé de cache d'une couche, sans sérialisation de ses géométries
+
+    Args:
+        gdf (GeoDataFrame): couche à identifier
+
+    Returns:
+        tuple: nombre d'entités, colonnes et emprise de la couche
+    """
+    return (len(gdf), tuple(gdf.columns), gdf.total_bounds.tobytes())
+
+#-------------------------------------------------------------------------------
+
+@st.cache_data(ttl=DUREE_CACHE, show_spinner=False,
+               hash_funcs={gpd.GeoDataFrame: _cle_gdf})
+def _geojson(gdf, tolerance=None):
+    """Sérialisation GeoJSON des géométries d'une couche à afficher.
+    Activation du cache dans l'application Streamlit
+
+    Args:
+        gdf (GeoDataFrame): couche à sérialiser
+        tolerance (float, optional): tolérance de simplification des géométries
+        (dans l'unité du CRS), pas de simplification si None
+
+    Returns:
+        str: géométries de la couche au format GeoJSON
+    """
+    geometries = gdf.geometry
+    if tolerance is not None:
+        geometries = geometries.simplify(tolerance, preserve_topology=True)
+    # fin
+    return geometries.to_json()
+
+#-------------------------------------------------------------------------------
+
+@st.cache_resource
+def _session(cache_http=True):
+    """Session HTTP partagée par toutes les exécutions de l'application :
+    les connexions vers un même serveur sont conservées et réutilisées.
+    Avec cache_http, les réponses sont conservées dans un cache persistant sur disque,
+    revalidé auprès du serveur (ETag / Last-Modified) à son expiration.
+    Sans cache_http, pour les téléchargements lus au fil de la réception :
+    requests_cache lirait la réponse en entier avant de la renvoyer
+
+    Args:
+        cache_http (bool): vrai pour la session avec cache HTTP sur disque
+
+    Returns:
+        requests.Session: session HTTP
+    """
+    if cache_http:
+        session = requests_cache.CachedSession(os.path.join(Racine, 'http_cache'),
+                                               backend='sqlite',
+                                               expire_after=DUREE_CACHE,
+                                               cache_control=True,
+                                               match_headers=['Range'])
+    else:
+        session = requests.Session()
+    adaptateur = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+    session.mount("http://", adaptateur)
+    session.mount("https://", adaptateur)
+    # fin
+    return session
+
+#-------------------------------------------------------------------------------
+
+@st.cache_resource
+def _executeur(nom):
+    """Pool de threads partagé pour les téléchargements et lectures en tâche de fond.
+    Les archives des arrêtés ('arretes') ont leur propre pool, d'un seul thread :
+    un téléchargement lent n'occupe pas les threads dont dépendent les zones
+    d'arrêtés et les deux couches statiques ('couches').
+    GDAL et les requêtes réseau libèrent le GIL pendant leur exécution
+
+    Args:
+        nom (str): usage du pool, 'arretes' ou 'couches'
+
+    Returns:
+        ThreadPoolExecutor: pool de threads
+    """
+    return concurrent.futures.ThreadPoolExecutor(max_workers=1 if nom == "arretes" else 4,
+                                                 thread_name_prefix=nom)
+
+#-------------------------------------------------------------------------------
+
+def _soumettre(nom, fonction, *args):
+    """Exécution d'une fonction en tâche de fond.
+    Le contexte d'exécution Streamlit est transmis au thread,
+    pour l'usage des caches et des éléments d'affichage
+
+    Args:
+        nom (str): usage du pool de threads, 'arretes' ou 'couches'
+        fonction (callable): fonction à exécuter
+        *args: arguments de la fonction
+
+    Returns:
+        Future: résultat à venir de la fonction
+    """
+    ctx = get_script_run_ctx()
+
+    def _executer():
+        add_script_run_ctx(ctx=ctx)
+        return fonction(*args)
+
+    # fin
+    return _executeur(nom).submit(_executer)
+
+#-------------------------------------------------------------------------------
+
+@reessayer
+def _lire_etag(url):
+    """Lecture de l'ETag d'une ressource distante, avec nouvelles tentatives en cas d'échec
+
+    Args:
+        url (str): adresse de la ressource distante
+
+    Returns:
+        str: ETag de la ressource, None si le serveur n'en fournit pas
+    """
+    rep = _session().head(url, allow_redirects=True, timeout=DELAI_HTTP)
+    rep.raise_for_status()
+    # fin
+    return rep.headers.get("ETag")
+
 #-------------------------------------------------------------------------------
 
-def get_zones_secheresse(uploaded_file):
+def _chemin_sauvegarde(prefixe, url):
+    """Chemin du fichier parquet de sauvegarde des données traitées issues d'une URL,
+    identifié par la version du format et l'ETag de la ressource distante
+
+    Args:
+        prefixe (str): préfixe du nom de fichier, propre au type de données
+        url (str): adresse de la ressource distante
+
+    Returns:
+        str: chemin du fichier parquet, None si le serveur ne fournit pas d'ETag
+        ou ne répond pas (les données sont alors lues sans sauvegarde)
+    """
+    try:
+        etag = _lire_etag(url)
+    except requests.RequestException as e:
+        logger.warning("ETag de %s non disponible : %s", url, e)
+        return None
+    if not etag:
+        return None
+    cle = hashlib.sha1(etag.encode()).hexdigest()[:16]
+    # fin
+    return os.path.join(Racine, f"{prefixe}_v{VERSION_SAUVEGARDE}_{cle}.parquet")
+
+#-------------------------------------------------------------------------------
+
+def _sauvegarder(df, chemin, prefixe):
+    """Sauvegarde des données traitées au format (Geo)Parquet.
+    Les sauvegardes précédentes de même préfixe sont supprimées.
+
+    Sans ETag, la sauvegarde porte un nom fixe : elle ne sert alors que de repli
+    en cas d'échec du téléchargement (lire_derniere_sauvegarde).
+
+    Args:
+        df (DataFrame ou GeoDataFrame): données à sauvegarder
+        chemin (str): chemin du fichier parquet, None si le serveur ne fournit pas d'ETag
+        prefixe (str): préfixe du nom de fichier, propre au type de données
+    """
+    if chemin is None:
+        chemin = os.path.join(Racine, f"{prefixe}_v{VERSION_SAUVEGARDE}_sans_etag.parquet")
+    try:
+        df.to_parquet(chemin, compression='zstd')
+    except Exception as e:
+        # la sauvegarde n'est qu'une optimisation : pas d'arrêt de l'application
+        logger.warning("Sauvegarde %s impossible : %s", chemin, e)
+        return
+    # nettoyage des anciennes sauvegardes, y compris celles d'un autre format
+    for ancien in glob.glob(os.path.join(Racine, f"{prefixe}_*.parquet")):
+        if ancien != chemin:
+            os.remove(ancien)
+
+#-------------------------------------------------------------------------------
+
+@st.cache_data(ttl=DUREE_CACHE, hash_funcs={UploadedFile: _cle_fichier})
+def get_zones_secheresse(uploaded_file, dst_crs=CRS_CARTE):
     """Requête de récupération des zones d'arrêté sécheresse.
-    Renvoie uniquement les zones de type 'SUP' pour les eaux superficielles
+    Renvoie uniquement les zones de type 'SUP' pour les eaux superficielles,
+    reprojetées une seule fois dans le CRS demandé avant leur mise en cache
 
     Args:
         uploaded_file: fichier GeoJSON ou ZIP contenant les données
+        dst_crs (str): CRS des zones renvoyées, par défaut celui de la carte
 
     Returns:
         geoDataFrame: zones filtrées sur le type 'SUP'
     """
-    # pour savoir si réunifier les tuiles
-    traiter_pmtiles = False
     if uploaded_file is not None:
         # lecture du fichier GeoJSON ou ZIP
         st.sidebar.markdown(f"## Fichier à lire : {uploaded_file.name}")
-        zones_arretes = lire_geopandas(uploaded_file)
-    else:
-        # URL stable de la couche
-        #url_zones_arretes = "https://www.data.gouv.fr/fr/datasets/r/bfba7898-aed3-40ec-aa74-abb73b92a363"
-        # URL stable de la couche au format PMTiles
-        url_zones_arretes = "https://object.files.data.gouv.fr/hydra-pmtiles/hydra-pmtiles/bfba7898-aed3-40ec-aa74-abb73b92a363.pmtiles"
+        # avec pyogrio : filtres et colonnes appliqués dès la lecture
+        zones_arretes = gpd.read_file(uploaded_file,
+                                      engine="pyogrio",
+                                      bbox=EMPRISE_METROPOLE,
+                                      where="type='SUP'",
+                                      columns=COLONNES_ZONES)
+        return _traiter_zones(zones_arretes, traiter_pmtiles=False, dst_crs=dst_crs)
+
+    st.sidebar.markdown(f"## Requête auprès de : {URL_ZONES_ARRETES}")
+    # zones déjà traitées pour la même version de la couche
+    chemin_sauvegarde = _chemin_sauvegarde("zones", URL_ZONES_ARRETES)
+    if chemin_sauvegarde is not None and os.path.exists(chemin_sauvegarde):
+        return gpd.read_parquet(chemin_sauvegarde).to_crs(dst_crs)
+
+    # lecture directe par GDAL, par requêtes HTTP partielles :
+    # seules les tuiles de la métropole sont récupérées, filtrées sur le type 'SUP',
+    # avec uniquement les colonnes utilisées
+    zones_arretes = gpd.read_file(f"/vsicurl/{URL_ZONES_ARRETES}",
+                                  bbox=EMPRISE_METROPOLE,
+                                  where="type='SUP'",
+                                  columns=COLONNES_ZONES)
+    # pour réunifier les tuiles
+    zones_arretes = _traiter_zones(zones_arretes, traiter_pmtiles=True, dst_crs=dst_crs)
+
+    _sauvegarder(zones_arretes, chemin_sauvegarde, "zones")
+    # fin
+    return zones_arretes
+
+#-------------------------------------------------------------------------------
+
+@st.cache_data(ttl=DUREE_CACHE, show_spinner=False)
+def get_infos_pmtiles(url):
+    """Lecture des informations nécessaires à l'affichage d'une archive PMTiles
+    dans le navigateur
+
+    Args:
+        url (str): adresse de l'archive PMTiles
+
+    Returns:
+        (str,int): (nom de la couche vectorielle, niveau de zoom maximal des tuiles),
+        erreur levée si la ressource n'est pas une archive PMTiles v3
+    """
+    nom_couche = gpd.list_layers(f"/vsicurl/{url}")["name"].iloc[0]
+    # entête PMTiles v3 de 127 octets : le zoom maximal est l'octet 101
+    rep = _session().get(url, headers={"Range": "bytes=0-126"}, timeout=DELAI_HTTP)
+    rep.raise_for_status()
+    entete = rep.content[:127]
+    # réponse d'erreur ou page HTML : pas de valeur erronée conservée en cache
+    if len(entete) < 127 or entete[:7] != b"PMTiles" or entete[7] != 3:
+        raise ValueError(f"Entête PMTiles v3 invalide : {url}")
+    zoom_max = entete[101]
+    # fin
+    return nom_couche, zoom_max
+
+#-------------------------------------------------------------------------------
+
+def _extraire_champ_json(serie, champ):
+    """Extraction vectorisée d'un champ des objets JSON d'une colonne, plutôt
+    qu'un json.loads par ligne. Les objets sont du texte dans les tuiles PMTiles,
+    mais déjà décodés en dict par pyogrio pour un fichier GeoJSON.
+
+    Args:
+        serie (Series): colonne d'objets JSON
+        champ (str): nom du champ à extraire
+
+    Returns:
+        Series: valeurs du champ
+    """
+    if pd.api.types.infer_dtype(serie, skipna=True) == "string":
+        return serie.str.extract(rf'"{champ}"\s*:\s*"([^"]+)"', expand=False)
+    return serie.str.get(champ)
 
-        # requête du fichier
-        st.sidebar.markdown(f"## Requête auprès de : {url_zones_arretes}")
-        rep = requests.get(url_zones_arretes)
+#-------------------------------------------------------------------------------
 
-        fio = io.BytesIO(rep.content)
-        # dans geopandas
-        zones_arretes = gpd.read_file(fio)
-        traiter_pmtiles = True
+def _niveaux_gravite(serie):
+    """Conversion des niveaux de gravité en catégories ordonnées (NIVEAUX_GRAVITE).
+    Un niveau absent de la liste devient NaN et n'est donc compté dans aucun niveau :
+    les valeurs concernées sont signalées dans le journal
 
+    Args:
+        serie (Series): niveaux de gravité en texte
+
+    Returns:
+        Series: niveaux de gravité en catégories ordonnées
+    """
+    niveaux = serie.astype(NIVEAUX_GRAVITE)
+    inconnus = serie[niveaux.isna() & serie.notna()].unique()
+    if len(inconnus) > 0:
+        logger.warning("Niveaux de gravité inconnus ignorés : %s",
+                       ", ".join(map(str, inconnus)))
+    # fin
+    return niveaux
+
+#-------------------------------------------------------------------------------
+
+def _traiter_zones(zones_arretes, traiter_pmtiles, dst_crs=CRS_CARTE):
+    """Mise en forme des zones d'arrêté sécheresse lues
+
+    Args:
+        zones_arretes (GeoDataFrame): zones lues depuis le fichier ou l'URL
+        traiter_pmtiles (bool): vrai si les zones sont issues de tuiles PMTiles
+        dst_crs (str): CRS des zones renvoyées
+
+    Returns:
+        geoDataFrame: zones filtrées sur le type 'SUP'
+    """
     # on ne garde que le type 'SUP'
-    zones_arretes = zones_arretes[zones_arretes["type"] == "SUP"]
+    zones_arretes = zones_arretes[zones_arretes["type"] == "SUP"].copy()
 
     # pour le traitement des tuiles pmtiles : il faut fusionner les polygones par id
     if traiter_pmtiles:
-        zones_arretes = zones_arretes.dissolve(by='id', aggfunc='first')
+        zones_arretes = _fusionner_tuiles(zones_arretes)
 
     # gestion du code de département des zones d'arrêtés
-    zones_arretes['insee_dept'] = zones_arretes['departement'].apply(lambda x: json.loads(x)['code'])
+    zones_arretes['insee_dept'] = _extraire_champ_json(zones_arretes['departement'], 'code')
 
     # filtre pour ne conserver que l'affichage des départements de métropole (longueur de code dept < 3)
-    zones_arretes = zones_arretes.where(zones_arretes["insee_dept"].apply(lambda x:len(x)<3))
-    zones_arretes = zones_arretes.dropna(axis=0, subset='insee_dept')
+    zones_arretes = zones_arretes[zones_arretes["insee_dept"].str.len() < 3].copy()
 
     # ajout de l'information du lien vers l'arrêté en fichier pdf
-    zones_arretes['chemin_fichier'] = zones_arretes['arreteRestriction'].apply(lambda x: json.loads(x)['fichier'])
+    zones_arretes['chemin_fichier'] = _extraire_champ_json(zones_arretes['arreteRestriction'], 'fichier')
+
+    # niveaux de gravité en catégories ordonnées
+    zones_arretes['niveauGravite'] = _niveaux_gravite(zones_arretes['niveauGravite'])
+
+    # reprojection dans le CRS demandé (les tuiles PMTiles sont en Web Mercator)
+    zones_arretes = zones_arretes.to_crs(dst_crs)
     # fin
     return zones_arretes
 
 #-------------------------------------------------------------------------------
 
-@st.cache_data
+def _couverture_valide(zones_decoupees):
+    """Vérification, zone par zone, que ses morceaux forment une couverture valide :
+    pas de recouvrement et bords communs identiques. Le découpage et l'arrondi
+    des coordonnées des tuiles ne le garantissent pas, et CoverageUnion renvoie
+    sans erreur une géométrie fausse sur une couverture invalide
+
+    Args:
+        zones_decoupees (GeoDataFrame): morceaux des zones réparties sur plusieurs tuiles
+
+    Returns:
+        Series: vrai pour les morceaux des zones à couverture valide
+    """
+    if not FUSION_COUVERTURE:
+        return pd.Series(False, index=zones_decoupees.index)
+    valides = zones_decoupees.groupby('id').geometry.agg(
+        lambda morceaux: shapely.coverage_is_valid(np.asarray(morceaux.values)))
+    # fin
+    return zones_decoupees['id'].map(valides).astype(bool)
+
+#-------------------------------------------------------------------------------
+
+def _fusionner_tuiles(zones_arretes):
+    """Fusion par id des polygones découpés selon les tuiles PMTiles.
+    Seules les zones présentes dans plusieurs tuiles passent par dissolve,
+    les autres sont simplement indexées par leur id.
+    L'union rapide par couverture n'est utilisée que pour les zones dont
+    les morceaux forment une couverture valide, les autres passent par UnaryUnion.
+
+    Args:
+        zones_arretes (GeoDataFrame): zones issues des tuiles PMTiles
+
+    Returns:
+        GeoDataFrame: zones fusionnées, indexées par id
+    """
+    # zones réparties sur plusieurs tuiles
+    doublons = zones_arretes.duplicated('id', keep=False)
+
+    # zones contenues dans une seule tuile : pas d'union des géométries
+    zones_fusion = [zones_arretes[~doublons].set_index('id')]
+    if doublons.any():
+        zones_decoupees = zones_arretes[doublons]
+        couverture = _couverture_valide(zones_decoupees)
+        for masque, methode in [(couverture, 'coverage'), (~couverture, 'unary')]:
+            if masque.any():
+                zones_fusion.append(zones_decoupees[masque].dissolve(by='id',
+                                                                     aggfunc='first',
+                                                                     method=methode))
+    zones_fusion = pd.concat(zones_fusion)
+    # même ordre que dissolve sur l'ensemble des zones
+    zones_fusion = zones_fusion.sort_index()
+    # fin
+    return zones_fusion
+
+#-------------------------------------------------------------------------------
+
 def lire_geopandas(fic_couche):
-    """lecture de la couche depuis le fichier passé en paramètre.
-    Activation du cache dans l'application Streamlit
+    """lecture de la couche depuis le fichier passé en paramètre,
+    et reprojection dans le CRS de la carte.
+    Pas de cache propre : la couche est conservée par charger_couches_statiques
 
     Args:
         fic_couche (str): nom de fichier local à lire
 
     Returns:
-        GeoDataFrame: couche lue
+        GeoDataFrame: couche lue, en WGS 84
     """
-    gdf = gpd.read_file(fic_couche)
+    gdf = gpd.read_file(fic_couche).to_crs(CRS_CARTE)
     return gdf
 
 #-------------------------------------------------------------------------------
 
-@st.cache_data
+@st.cache_resource
+def charger_couches_statiques(racine):
+    """lecture des couches locales qui n'évoluent pas, en WGS 84.
+    Activation du cache dans l'application Streamlit : les mêmes couches
+    sont partagées, sans copie, par toutes les exécutions de l'application.
+    Les deux couches sont lues en parallèle, au premier appel uniquement
+
+    Args:
+        racine (str): dossier contenant les couches
+
+    Returns:
+        (GeoDataFrame,GeoDataFrame): (itinéraires COP, départements du réseau VNF)
+    """
+    # itinéraires COP
+    futur_itineraire = _soumettre("couches", lire_geopandas, os.path.join(racine,"Export_Itineraire_COP.gpkg"))
+    # départements réseau VNF
+    futur_dept_iti = _soumettre("couches", lire_geopandas, os.path.join(racine,"departements_itineraires.gpkg"))
+    # fin
+    return futur_itineraire.result(), futur_dept_iti.result()
+
+#-------------------------------------------------------------------------------
+
+@reessayer
+def _telecharger_arretes(url_arretes):
+    """Téléchargement des arrêtés archivés, avec nouvelles tentatives en cas d'échec
+
+    Args:
+        url_arretes (str): url des archives des arrêtés
+
+    Returns:
+        DataFrame: tableau brut des arrêtés, colonnes utilisées uniquement
+    """
+    # requête du fichier et chargement des données dans un dataframe
+    # au fil de la réception, hors cache HTTP (les archives traitées
+    # sont déjà sauvegardées en parquet, identifiées par leur ETag)
+    with _session(cache_http=False).get(url_arretes, stream=True,
+                                            timeout=DELAI_HTTP) as rep:
+        rep.raise_for_status()
+        rep.raw.decode_content = True
+        df_arretes = pd.read_csv(rep.raw,
+                                 sep=',',
+                                 usecols=COLONNES_ARRETES,
+                                 dtype={'departement': str})
+    # fin
+    return df_arretes
+
+#-------------------------------------------------------------------------------
+
+def lire_derniere_sauvegarde(prefixe):
+    """Lecture de la dernière sauvegarde Parquet réussie, quel que soit l'ETag
+    des données, pour continuer à présenter des données quand leur téléchargement échoue.
+    Seules les sauvegardes du format courant (VERSION_SAUVEGARDE) sont relues
+
+    Args:
+        prefixe (str): préfixe du nom de fichier, propre au type de données
+
+    Returns:
+        DataFrame: données sauvegardées, vide si aucune sauvegarde n'existe
+    """
+    sauvegardes = glob.glob(os.path.join(Racine, f"{prefixe}_v{VERSION_SAUVEGARDE}_*.parquet"))
+    if not sauvegardes:
+        return pd.DataFrame()
+    # fin
+    return pd.read_parquet(max(sauvegardes, key=os.path.getmtime))
+
+#-------------------------------------------------------------------------------
+
+@st.cache_data(ttl=DUREE_CACHE, show_spinner=False)
 def get_arretes():
     """Requête de récupération des arrêtés de restriction archivés
 
     Returns:
-        DataFrame: tableau des arrêtés récupérés
+        DataFrame: tableau des arrêtés récupérés, une ligne par zone d'alerte SUP
     """
     # url des archives des arrêtés
     url_arretes = "https://www.data.gouv.fr/fr/datasets/r/f425cfa6-ccd1-438e-bb03-9d90ab527851"
 
-    # requête du fichier
-    rep = requests.get(url_arretes)
+    # archives déjà traitées pour la même version du fichier
+    chemin_sauvegarde = _chemin_sauvegarde("arretes", url_arretes)
+    if chemin_sauvegarde is not None and os.path.exists(chemin_sauvegarde):
+        return pd.read_parquet(chemin_sauvegarde)
 
-    # chargement des données dans un dataframe
-    fio = io.BytesIO(rep.content)
-
-    # avec analyse des dates sur 3 colonnes
-    df_arretes = pd.read_csv(fio,sep=',')
+    df_arretes = _telecharger_arretes(url_arretes)
     df_arretes = df_arretes.dropna(axis=0,how='any', subset='date_fin')
+
+    # conversion unique des listes de zones d'alerte, réutilisée à chaque calcul d'indicateur
+    colonnes_zones = ['zones_alerte.niveau_gravite', 'zones_alerte.type']
+    for colonne in colonnes_zones:
+        df_arretes[colonne] = convertir_liste(df_arretes[colonne])
+    # séparation des listes : en une entrée par valeur pour les deux colonnes à travailler
+    df_arretes = df_arretes.explode(colonnes_zones, ignore_index=True)
+
+    # filtre zones_alerte.type : SUP pour les eaux superficielles
+    df_arretes = df_arretes[df_arretes['zones_alerte.type'] == 'SUP'].copy()
+    # niveaux de gravité en catégories ordonnées, conservées dans la sauvegarde parquet
+    df_arretes['zones_alerte.niveau_gravite'] = _niveaux_gravite(df_arretes['zones_alerte.niveau_gravite'])
+
+    _sauvegarder(df_arretes, chemin_sauvegarde, "arretes")
     # fin
     return df_arretes
 
 #-------------------------------------------------------------------------------
 
+@functools.lru_cache
+def _legend_body(title, categories, colors):
+    """Code HTML du corps de la légende, mis en cache entre deux exécutions
+    de l'application Streamlit
+
+    Args:
+        title (str): titre de la légende
+        categories (tuple): catégories de la légende
+        colors (tuple): couleurs des catégories (dans le même ordre)
+
+    Returns:
+        str: code HTML du corps de la légende
+    """
+    # Loop Categories
+    labels = "".join(f"""
+                <li><span style='background:{color}'></span>{label}</li>"""
+                     for label, color in zip(categories, colors))
+
+    return f"""
+    <div id='maplegend {title}' class='maplegend'>
+        <div class='legend-title'>{title}</div>
+        <div class='legend-scale'>
+            <ul class='legend-labels'>{labels}
+            </ul>
+        </div>
+    </div>
+    """
+
+#-------------------------------------------------------------------------------
+
 def _categorical_legend(m, title, categories, colors):
     """
     MODIFICATION POUR POSITIONNER LA LEGENDE
@@ -221,22 +763,8 @@ def _categorical_legend(m, title, categories, colors):
     macro._template = bc.element.Template(head)
     m.get_root().add_child(macro)
 
-    body = f"""
-    <div id='maplegend {title}' class='maplegend'>
-        <div class='legend-title'>{title}</div>
-        <div class='legend-scale'>
-            <ul class='legend-labels'>"""
-
-    # Loop Categories
-    for label, color in zip(categories, colors):
-        body += f"""
-                <li><span style='background:{color}'></span>{label}</li>"""
-
-    body += """
-            </ul>
-        </div>
-    </div>
-    """
+    # Body HTML, built once per (title, categories, colors)
+    body = _legend_body(title, tuple(categories), tuple(colors))
 
     # Add Body
     body = bc.element.Element(body, "legend")
@@ -244,8 +772,147 @@ def _categorical_legend(m, title, categories, colors):
 
 #-------------------------------------------------------------------------------
 
+class CouchePMTiles(JSCSSMixin, Layer):
+    """Couche des zones d'arrêtés lue directement par le navigateur dans l'archive PMTiles
+    avec la bibliothèque protomaps-leaflet : seules les tuiles visibles sont récupérées,
+    par requêtes HTTP partielles, et dessinées dans un canvas.
+    Les zones sont filtrées comme dans get_zones_secheresse : type 'SUP' et
+    départements de métropole (code de département de moins de 3 caractères).
+    Infobulle et fenêtre au clic (avec le lien vers l'arrêté) comme pour explore,
+    à partir des entités des tuiles sous le pointeur.
+
+    Args:
+        url (str): adresse de l'archive PMTiles
+        nom_couche (str): nom de la couche vectorielle des tuiles
+        zoom_max (int): niveau de zoom maximal des tuiles de l'archive
+        niveaux (list): codes des niveaux de gravité à afficher
+        couleurs (list): couleurs des niveaux (dans le même ordre)
+        name (str): nom de la couche dans le contrôle des couches
+    """
+    _template = bc.element.Template("""
+        {% macro script(this, kwargs) %}
+            // zones affichées : type 'SUP' et départements de métropole
+            function {{ this.get_name() }}_zone_affichee(props) {
+                return props.type === "SUP"
+                    && /"code"\\s*:\\s*"[^"]{1,2}"/.test(props.departement);
+            }
+
+            var {{ this.get_name() }} = protomapsL.leafletLayer({
+                url: {{ this.url|tojson }},
+                maxDataZoom: {{ this.zoom_max }},
+                paintRules: [
+                {%- for niveau, couleur in this.styles %}
+                    {
+                        dataLayer: {{ this.nom_couche|tojson }},
+                        symbolizer: new protomapsL.PolygonSymbolizer({
+                            fill: {{ couleur|tojson }},
+                            opacity: 0.5,
+                            stroke: {{ couleur|tojson }},
+                            width: 1,
+                        }),
+                        filter: (z, f) => {{ this.get_name() }}_zone_affichee(f.props)
+                            && f.props.niveauGravite === {{ niveau|tojson }},
+                    },
+                {%- endfor %}
+                ],
+            }).addTo({{ this._parent.get_name() }});
+
+            // zones affichées sous le pointeur, une seule fois par id
+            // (une zone découpée par les tuiles est présente dans chacune d'elles)
+            function {{ this.get_name() }}_zones_sous(latlng) {
+                var zones = {};
+                if (!{{ this._parent.get_name() }}.hasLayer({{ this.get_name() }})) {
+                    return [];
+                }
+                {{ this.get_name() }}.queryTileFeaturesDebug(latlng.lng, latlng.lat).forEach(function(selection) {
+                    selection.forEach(function(p) {
+                        if (p.layerName === {{ this.nom_couche|tojson }}
+                            && !(p.feature.props.id in zones)
+                            && {{ this.get_name() }}_zone_affichee(p.feature.props)) {
+                            zones[p.feature.props.id] = p.feature.props;
+                        }
+                    });
+                });
+                return Object.values(zones);
+            }
+
+            // texte échappé pour insertion en HTML
+            function {{ this.get_name() }}_texte(valeur) {
+                return String(valeur === undefined || valeur === null ? "" : valeur)
+                    .replace(/[&<>"']/g, c => "&#" + c.charCodeAt(0) + ";");
+            }
+
+            // champ d'un objet JSON stocké en texte dans les tuiles
+            function {{ this.get_name() }}_champ(valeur, champ) {
+                try {
+                    return JSON.parse(valeur)[champ];
+                } catch (e) {
+                    return undefined;
+                }
+            }
+
+            // infobulle : niveau de gravité et département, comme explore
+            var {{ this.get_name() }}_infobulle = L.tooltip();
+            {{ this._parent.get_name() }}.on("mousemove", function(e) {
+                var zones = {{ this.get_name() }}_zones_sous(e.latlng);
+                if (!zones.length) {
+                    {{ this.get_name() }}_infobulle.remove();
+                    return;
+                }
+                {{ this.get_name() }}_infobulle
+                    .setLatLng(e.latlng)
+                    .setContent(zones.map(z => {{ this.get_name() }}_texte(z.niveauGravite)
+                        + " - " + {{ this.get_name() }}_texte(
+                            {{ this.get_name() }}_champ(z.departement, "nom") || z.departement)
+                    ).join("<br>"))
+                    .addTo({{ this._parent.get_name() }});
+            });
+
+            // fenêtre au clic : détail des zones et lien vers l'arrêté en pdf
+            {{ this._parent.get_name() }}.on("click", function(e) {
+                var zones = {{ this.get_name() }}_zones_sous(e.latlng);
+                if (!zones.length) {
+                    return;
+                }
+                var contenu = zones.map(function(z) {
+                    var lignes = [
+                        ["id", z.id],
+                        ["niveauGravite", z.niveauGravite],
+                        ["departement", {{ this.get_name() }}_champ(z.departement, "nom") || z.departement],
+                    ].map(l => "<tr><th>" + l[0] + "</th><td>"
+                              + {{ this.get_name() }}_texte(l[1]) + "</td></tr>");
+                    var fichier = {{ this.get_name() }}_champ(z.arreteRestriction, "fichier");
+                    if (typeof fichier === "string" && /^https?:/.test(fichier)) {
+                        lignes.push('<tr><th>arrêté</th><td><a href="' + {{ this.get_name() }}_texte(fichier)
+                                    + '" target="_blank">fichier pdf</a></td></tr>');
+                    }
+                    return "<table>" + lignes.join("") + "</table>";
+                }).join("<hr>");
+                L.popup({maxWidth: 300})
+                    .setLatLng(e.latlng)
+                    .setContent(contenu)
+                    .openOn({{ this._parent.get_name() }});
+            });
+        {% endmacro %}
+        """)
+
+    default_js = [("protomaps-leaflet", URL_PROTOMAPS_LEAFLET)]
+
+    def __init__(self, url, nom_couche, zoom_max, niveaux, couleurs, name=None):
+        super().__init__(name=name, overlay=True, control=True, show=True)
+        self._name = "CouchePMTiles"
+        self.url = url
+        self.nom_couche = nom_couche
+        self.zoom_max = zoom_max
+        self.styles = list(zip(niveaux, couleurs))
+
+#-------------------------------------------------------------------------------
+
 def construire_carte(itineraire, zones_arrete, dept_iti, uploaded_file):
-    """construction de la carte folium basée sur les deux couches passées en paramètre
+    """construction de la carte folium basée sur les deux couches passées en paramètre.
+    La carte est reconstruite à chaque exécution : st_folium modifie les identifiants
+    de ses éléments à l'affichage, une même instance ne peut donc pas être partagée
+    entre exécutions ou sessions
 
     Args:
         itineraire (GeoDataFrame): couche des itinéraires COP
@@ -264,8 +931,9 @@ def construire_carte(itineraire, zones_arrete, dept_iti, uploaded_file):
     niveaux  = ["vigilance", "alerte",  "alerte renforcée", "crise"]
     couleurs = ["#ffeda0",   "#feb24c", "#fc4e2a", "#b10026"]
     # assignation avec l'intermédiaire des codes de niveau
-    codes_niveau = ["vigilance", "alerte",  "alerte_renforcee", "crise"]
-    czones_arrete["couleur"] = czones_arrete["niveauGravite"].map(dict(zip(codes_niveau,couleurs)))
+    codes_niveau = list(NIVEAUX_GRAVITE.categories)
+    # (catégories des niveaux renommées en couleurs : indexation directe sur les codes)
+    czones_arrete["couleur"] = czones_arrete["niveauGravite"].cat.rename_categories(couleurs)
 
     # carte centrée sur ce point choisi manuellement
     centre = [46.463,2.661]
@@ -279,29 +947,54 @@ def construire_carte(itineraire, zones_arrete, dept_iti, uploaded_file):
         location=centre,
         #attr=attr,
         tiles= "OpenStreetMap", # "https://{s}.tile.openstreetmap.fr/osmfr/{z}/{x}/{y}.png",
+        prefer_canvas=True, # rendu canvas plutôt que SVG
     )
 
     carte.fit_bounds([[bounds[1],bounds[0]],
                       [bounds[3],bounds[2]]])
 
-    # ajout de la couche départements
-    folium.GeoJson(dept_iti,
+    # ajout de la couche départements, simplifiée pour l'affichage
+    folium.GeoJson(_geojson(dept_iti, TOLERANCE_DEPARTEMENTS),
                   name="Départements réseau VNF",
                   style_function=lambda x: {"color": "#c0c0c0", "weight": 2},
+                  smooth_factor=2.0,
                   ).add_to(carte)
 
     # ajout des zones d'arrêté avec contrôle de la légende
-    czones_arrete.explore(m=carte,
-        column='niveauGravite',
-        tooltip=['niveauGravite', 'departement'],
-        categorical=True,
-        categories=codes_niveau,
-        k=len(codes_niveau),
-        cmap=couleurs,
-        popup=True,
-        legend=False,
-        name= "Zones d'arrêtés sécheresse",
-        )
+    infos_pmtiles = None
+    if uploaded_file is None:
+        try:
+            infos_pmtiles = get_infos_pmtiles(URL_ZONES_ARRETES)
+        except Exception as e:
+            # archive illisible : zones déjà lues affichées en GeoJSON
+            logger.warning("Affichage PMTiles impossible : %s", e)
+
+    if infos_pmtiles is not None:
+        # tuiles vectorielles chargées par le navigateur selon la vue affichée
+        nom_couche, zoom_max = infos_pmtiles
+        CouchePMTiles(URL_ZONES_ARRETES,
+                      nom_couche,
+                      zoom_max,
+                      niveaux=codes_niveau,
+                      couleurs=couleurs,
+                      name="Zones d'arrêtés sécheresse",
+                      ).add_to(carte)
+    else:
+        # fichier téléchargé ou archive illisible : pas d'archive PMTiles à disposition,
+        # géométries simplifiées en un seul appel GEOS avant sérialisation
+        czones_arrete.geometry = shapely.simplify(czones_arrete.geometry.values,
+                                                  tolerance=TOLERANCE_ZONES,
+                                                  preserve_topology=True)
+        czones_arrete.explore(m=carte,
+            column='niveauGravite',
+            tooltip=['niveauGravite', 'departement'],
+            categorical=True, # ordre et couleurs des niveaux : ceux du type catégoriel
+            k=len(codes_niveau),
+            cmap=couleurs,
+            popup=True,
+            legend=False,
+            name= "Zones d'arrêtés sécheresse",
+            )
 
     # légende "à la main" issue de la fonction d'explore,
     # mais avec positionnement adapté à cette carte
@@ -310,8 +1003,8 @@ def construire_carte(itineraire, zones_arrete, dept_iti, uploaded_file):
                         categories=niveaux,
                         colors=couleurs)
 
-    # ajout de la couche itinéraire
-    folium.GeoJson(itineraire,
+    # ajout de la couche itinéraire, simplifiée pour l'affichage
+    folium.GeoJson(_geojson(itineraire, TOLERANCE_ITINERAIRE),
                   name="Itinéraire COP",
                   style_function=lambda x: {"color": "#0000ff", "weight": 2},
                   ).add_to(carte)
@@ -339,22 +1032,21 @@ def construire_carte(itineraire, zones_arrete, dept_iti, uploaded_file):
 
 #-------------------------------------------------------------------------------
 
-def safe_literal_eval(value):
-    """Encapsulation de la fonction ast.literal_eval pour convertir la représentation en str
-    d'une liste de valeurs ou une seule valeur en liste
+def convertir_liste(serie):
+    """Conversion vectorisée de la représentation en str d'une liste de valeurs
+    ou d'une seule valeur en liste
 
     Args:
-        value (str): valeur à convertir, supposée de la forme "[v1,v2,...]" ou simplement "v1"
+        serie (Series): valeurs à convertir, supposées de la forme "['v1', 'v2', ...]" ou simplement "v1"
 
     Returns:
-        list: liste contenant les données extraites du paramètre d'entrée
+        Series: listes contenant les données extraites de chaque valeur, sans guillemets
     """
-    try:
-        # Essayer de convertir en liste
-        return ast.literal_eval(value)
-    except (ValueError, SyntaxError):
-        # Si échec, retourner une liste avec la valeur unique
-        return [value]
+    # crochets et guillemets extérieurs retirés, puis découpage sur les séparateurs
+    # "', '" : les valeurs sont extraites propres en une seule passe
+    return serie.fillna('').astype(str) \
+                .str.strip("[]'\" ") \
+                .str.split(r"['\"]?\s*,\s*['\"]?", regex=True)
 
 #-------------------------------------------------------------------------------
 
@@ -363,44 +1055,48 @@ def calculer_dept_arretes_date(df_arretes, date_compar, niveaux):
     en date passée en paramètre et pour les niveaux parmi la liste passée en paramètre.
 
     Args:
-        df_arretes (DataFrame): archives des arrêtés à analyser
+        df_arretes (DataFrame): archives des arrêtés à analyser, une ligne par zone d'alerte SUP
         date_compar (str): date de rechercher des arrêtés au format iso (yyyy-mm-dd)
         niveaux (list): liste des niveaux à conserver parmi les niveaux de gravité des arrêtés
     """
+    # filtre dates : l'arrêté doit être valide au moment de la date de recherche
+    # et niveaux recherchés (les zones sont déjà séparées et filtrées sur le type SUP)
+    masque = (df_arretes['date_debut'] < date_compar) \
+           & (df_arretes['date_fin'] > date_compar) \
+           & df_arretes['zones_alerte.niveau_gravite'].isin(niveaux)
 
-    # initialisation
-    resultat = 0
+    # nombre de départements correspondants
+    resultat = df_arretes.loc[masque, 'departement'].nunique()
+    # fin
+    return resultat
 
-    # filtre dates : l'arrêté doit être valide au moment de la date de recherche
-    loc_df_arretes = df_arretes[df_arretes['date_debut'] < date_compar]
-    if not loc_df_arretes.empty:
-        loc_df_arretes = loc_df_arretes[loc_df_arretes['date_fin'] > date_compar]
-
-    # préparation pour séparer les listes de zones d'arrêtés concernées
-    if not loc_df_arretes.empty:
-        loc_df_arretes["zones_alerte.niveau_gravite"] = \
-            loc_df_arretes["zones_alerte.niveau_gravite"].apply(safe_literal_eval)
-        loc_df_arretes['zones_alerte.type'] = \
-            loc_df_arretes["zones_alerte.type"].apply(safe_literal_eval)
-        # séparation des listes : en une entrée par valeur pour les deux colonnes à travailler
-        loc_df_arretes = \
-            loc_df_arretes.explode(['zones_alerte.niveau_gravite','zones_alerte.type'],
-                                   ignore_index=True)
+#-------------------------------------------------------------------------------
 
-    # filtre zones_alerte.type : SUP pour les eaux superficielles
-    if not loc_df_arretes.empty:
-        loc_df_arretes = loc_df_arretes[loc_df_arretes['zones_alerte.type']=='SUP']
+def calculer_dept_arretes_date_niveaux(df_arretes, date_compar, niveaux):
+    """Calcul en une seule passe sur les arrêtés valides à la date passée en paramètre
+    du nombre de départements ayant des arrêtés de restriction en eau superficielle,
+    pour l'ensemble des niveaux passés en paramètre et pour chaque niveau de gravité.
 
-    # non vigilance
-    if not loc_df_arretes.empty:
-        df_arretes_non_vigi = \
-            loc_df_arretes[loc_df_arretes["zones_alerte.niveau_gravite"].isin(niveaux)]
+    Args:
+        df_arretes (DataFrame): archives des arrêtés à analyser, une ligne par zone d'alerte SUP
+        date_compar (str): date de rechercher des arrêtés au format iso (yyyy-mm-dd)
+        niveaux (list): liste des niveaux à cumuler parmi les niveaux de gravité des arrêtés
 
-        # nombre de départements au delà de la vigilance
-        if not df_arretes_non_vigi.empty:
-            resultat = len(df_arretes_non_vigi['departement'].unique())
+    Returns:
+        (int,Series): (nombre de départements sur l'ensemble des niveaux,
+        nombre de départements par niveau de gravité)
+    """
+    # filtre dates : l'arrêté doit être valide au moment de la date de recherche
+    masque = (df_arretes['date_debut'] < date_compar) & (df_arretes['date_fin'] > date_compar)
+    loc_df_arretes = df_arretes.loc[masque, ['departement', 'zones_alerte.niveau_gravite']]
+
+    # un département peut avoir plusieurs niveaux : le cumul se compte à part
+    nb_dept_niveaux = loc_df_arretes.loc[loc_df_arretes['zones_alerte.niveau_gravite'].isin(niveaux),
+                                         'departement'].nunique()
+    nb_dept_par_niveau = loc_df_arretes.groupby('zones_alerte.niveau_gravite',
+                                                observed=True)['departement'].nunique()
     # fin
-    return resultat
+    return nb_dept_niveaux, nb_dept_par_niveau
 
 #-------------------------------------------------------------------------------
 
@@ -435,52 +1131,37 @@ def calculer_dept_zone_restrict(zones_arretes):
     Returns:
         int: nombre de département correspondant au critère recherché
     """
-    # initialisation
-    resultat = 0
-    # zones d'arrêtés de restriction au delà de la vigilance
-    zones_non_vigilance = zones_arretes[zones_arretes['niveauGravite'] != "vigilance"]
-
-    # les départements correspondant à ces zones d'arrêtés
-    if not zones_non_vigilance.empty:
-        dept_res = zones_non_vigilance['insee_dept'].unique()
-        # nb de départements trouvés
-        resultat = len(dept_res)
+    # nb de départements des zones d'arrêtés de restriction au delà de la vigilance
+    resultat = zones_arretes.loc[zones_arretes['niveauGravite'] != "vigilance", 'insee_dept'].nunique()
     # fin
     return resultat
 
 #-------------------------------------------------------------------------------
 
-def calculer_dept_zone_vnf_niveau(zones_arretes, dept_iti, niveau):
-    """Calcul du nombre de départements du réseau VNF ayant des zones
-    d'arrêté au niveau de gravité recherché.
+def calculer_dept_zone_vnf_niveaux(zones_arretes, dept_iti):
+    """Calcul pour chaque niveau de gravité du nombre de départements du réseau VNF
+    ayant des zones d'arrêté à ce niveau.
 
     Args:
         zones_arretes (geoDataFrame): couche des zones d'arrêté de restriction à analyser
         dept_iti (geoDataFrame): couche des départements du réseau VNF
         (paramètre structurel fixé n'évoluant pas dans le temps)
-        niveau (str): chaîne de caractère indiquant le niveau de gravité à analyser.
-        Attention aux fautes de frappe...c'est du texte !
 
     Returns:
-        (int,str): (nombre, noms) des départements du réseau VNF ayant une zone de restriction dans
-        le niveau recherché
+        dict: pour chaque niveau de gravité présent, (nombre, noms) des départements
+        du réseau VNF ayant une zone de restriction à ce niveau
     """
-    # initialisation :
-    resultat = (0,'')
-
-    # zones en niveau spécifique sur le réseau VNF
-    zones_filtres = zones_arretes[zones_arretes['niveauGravite'] == niveau]
+    # couples (département, niveau) distincts des zones d'arrêtés
+    dept_niveaux = zones_arretes[['insee_dept', 'niveauGravite']].drop_duplicates()
 
-    # les départements correspondant à ces zones d'arrêtés
-    if not zones_filtres.empty:
-        dept_filtre = zones_filtres['insee_dept'].unique()
+    # jointure avec les départements du réseau VNF (ordre de dept_iti conservé)
+    dept_vnf = dept_iti[['insee_dep', 'nom']].merge(dept_niveaux,
+                                                    left_on='insee_dep',
+                                                    right_on='insee_dept')
 
-        # application du filtre
-        dept_resultat = dept_iti[dept_iti["insee_dep"].isin(dept_filtre)]
-
-        # résultat en nb de départements
-        if not dept_resultat.empty:
-            resultat = (len(dept_resultat), ", ".join(dept_resultat["nom"]))
+    # résultat en nb de départements et noms, par niveau
+    resultat = {niveau: (len(noms), ", ".join(noms))
+                for niveau, noms in dept_vnf.groupby('niveauGravite', observed=True)['nom']}
     # fin
     return resultat
 
@@ -536,10 +1217,11 @@ def construire_table_indic(df_arretes, zones_arretes, dept_iti):
     # nombre de départements n'étant pas en niveau vigilance
     nb_dept_r_z = calculer_dept_zone_restrict(zones_arretes)
     # nombre de départements du réseau VNF en crise et alerte renforcée
-    nb_dept_vnf_crise = calculer_dept_zone_vnf_niveau(zones_arretes, dept_iti, 'crise')
-    nb_dept_vnf_ar = calculer_dept_zone_vnf_niveau(zones_arretes, dept_iti, 'alerte_renforcee')
-    nb_dept_vnf_a = calculer_dept_zone_vnf_niveau(zones_arretes, dept_iti, 'alerte')
-    nb_dept_vnf_vg = calculer_dept_zone_vnf_niveau(zones_arretes, dept_iti, 'vigilance')
+    nb_dept_vnf_niveaux = calculer_dept_zone_vnf_niveaux(zones_arretes, dept_iti)
+    nb_dept_vnf_crise = nb_dept_vnf_niveaux.get('crise', (0,''))
+    nb_dept_vnf_ar = nb_dept_vnf_niveaux.get('alerte_renforcee', (0,''))
+    nb_dept_vnf_a = nb_dept_vnf_niveaux.get('alerte', (0,''))
+    nb_dept_vnf_vg = nb_dept_vnf_niveaux.get('vigilance', (0,''))
 
 
     # ajout au résultat
@@ -573,17 +1255,14 @@ def construire_table_indic(df_arretes, zones_arretes, dept_iti):
 
     # 1er jour du mois précédent (on fixe day=1 et on retranche 1 mois)
     date_compar = dt.date.today() + dateutil.relativedelta.relativedelta(months=-1, day=1)
-    # recherche sur tous les niveaux sauf vigilance
+    # recherche sur tous les niveaux sauf vigilance, et niveau par niveau
     niveaux = ["alerte",  "alerte_renforcee", "crise"]
-    nb_dept_r_z_mois_prec = calculer_dept_arretes_date(df_arretes, date_compar.isoformat(), niveaux)
-    niveaux = ["crise"]
-    nb_dept_vnf_crise_mois_prec = calculer_dept_arretes_date(df_arretes, date_compar.isoformat(), niveaux)
-    niveaux = ["alerte_renforcee"]
-    nb_dept_vnf_ar_mois_prec = calculer_dept_arretes_date(df_arretes, date_compar.isoformat(), niveaux)
-    niveaux = ["alerte"]
-    nb_dept_vnf_a_mois_prec = calculer_dept_arretes_date(df_arretes, date_compar.isoformat(), niveaux)
-    niveaux = ["vigilance"]
-    nb_dept_vnf_vg_mois_prec = calculer_dept_arretes_date(df_arretes, date_compar.isoformat(), niveaux)
+    nb_dept_r_z_mois_prec, nb_dept_par_niveau = \
+        calculer_dept_arretes_date_niveaux(df_arretes, date_compar.isoformat(), niveaux)
+    nb_dept_vnf_crise_mois_prec = int(nb_dept_par_niveau.get("crise", 0))
+    nb_dept_vnf_ar_mois_prec = int(nb_dept_par_niveau.get("alerte_renforcee", 0))
+    nb_dept_vnf_a_mois_prec = int(nb_dept_par_niveau.get("alerte", 0))
+    nb_dept_vnf_vg_mois_prec = int(nb_dept_par_niveau.get("vigilance", 0))
 
     # ajout au résultat
     df_resultat.loc['mois_precedent'] = [nb_dept_r_z_mois_prec,
@@ -728,6 +1407,25 @@ def inserer_indic_dept(table_indic):
 
 #-------------------------------------------------------------------------------
 
+def telecharger_arretes_fond():
+    """Téléchargement en tâche de fond des arrêtés archivés.
+    Un téléchargement encore en cours (après un délai d'attente dépassé)
+    est réutilisé plutôt que relancé à chaque exécution
+
+    Returns:
+        Future: tableau des arrêtés à venir
+    """
+    futur = st.session_state.get('futur_arretes')
+    # nouveau téléchargement seulement si aucun n'est en cours
+    # (un téléchargement terminé a rempli le cache de get_arretes)
+    if futur is None or futur.done():
+        futur = _soumettre("arretes", get_arretes)
+        st.session_state.futur_arretes = futur
+    # fin
+    return futur
+
+#-------------------------------------------------------------------------------
+
 def change_etat(valeur):
     """Change l'état de l'application en fonction de la valeur fournie."""
     st.session_state.construire_carte = valeur
@@ -765,37 +1463,47 @@ def main():
     st.sidebar.button("Afficher la carte", on_click=change_etat, args=[True])
 
     tab1,tab2 = st.tabs(["Carte des arrêtés", "Indicateurs des arrêtés"])
-    data_load_state = st.text('Chargement des données...')
 
-    # itinéraires COP
-    fic_couche = os.path.join(Racine,"Export_Itineraire_COP.gpkg")
-    itineraire = lire_geopandas(fic_couche)
-    # départements réseau VNF
-    fic_couche = os.path.join(Racine,"departements_itineraires.gpkg")
-    dept_iti = lire_geopandas(fic_couche)
-    # conversion du CRS en wgs 84
-    itineraire = itineraire.to_crs("EPSG:4326")
-    dept_iti   = dept_iti.to_crs("EPSG:4326")
-    # zones des arrêtés
-    zones_arretes = get_zones_secheresse(uploaded_file)
-    # conversion dans le même CRS que l'itinéraire
-    zones_arretes = zones_arretes.to_crs(itineraire.crs)
-
-    # arrêtés archivés dans le temps
-    try:
-        df_arretes = get_arretes()
-    except Exception as e:
-        print(e)
-        data_load_state.text('Echec du téléchargement des données des arrêtés')
-        df_arretes = pd.DataFrame()
+    # les données ne sont chargées et traitées qu'à la demande d'affichage,
+    # pas à chaque interaction avec l'application
+    if st.session_state.construire_carte:
+        data_load_state = st.text('Chargement des données...')
+
+        # arrêtés archivés dans le temps : téléchargement en tâche de fond,
+        # pendant le chargement des couches géographiques
+        futur_arretes = telecharger_arretes_fond()
+
+        # zones des arrêtés, lues en tâche de fond (couches déjà en wgs 84)
+        futur_zones = _soumettre("couches", get_zones_secheresse, uploaded_file, CRS_CARTE)
+        # itinéraires COP et départements réseau VNF, en parallèle
+        itineraire, dept_iti = charger_couches_statiques(Racine)
+        try:
+            zones_arretes = futur_zones.result(timeout=DELAI_ZONES)
+        except Exception as e:
+            logger.warning("Chargement des zones d'arrêtés impossible : %s", e)
+            data_load_state.text("Echec du chargement des zones d'arrêtés")
+            st.session_state.construire_carte = False
+            return
+
+        # attente des arrêtés archivés
+        try:
+            df_arretes = futur_arretes.result(timeout=DELAI_ARRETES)
+        except Exception as e:
+            logger.warning("Téléchargement des arrêtés impossible : %s", e)
+            # repli sur les dernières archives téléchargées avec succès
+            df_arretes = lire_derniere_sauvegarde("arretes")
+            if df_arretes.empty:
+                data_load_state.text('Echec du téléchargement des données des arrêtés')
+            else:
+                st.warning("Téléchargement des arrêtés impossible : "
+                           "indicateurs calculés sur les dernières données sauvegardées")
 
-    data_load_state.text('Chargement des données...Terminé !')
+        data_load_state.text('Chargement des données...Terminé !')
 
-    # construction de la table des indicateurs à afficher
-    if not df_arretes.empty:
-        table_indic = construire_table_indic(df_arretes, zones_arretes, dept_iti)
+        # construction de la table des indicateurs à afficher
+        if not df_arretes.empty:
+            table_indic = construire_table_indic(df_arretes, zones_arretes, dept_iti)
 
-    if st.session_state.construire_carte:
         # création de la carte
         data_load_state.text('Construction carte...')
         carte = construire_carte(itineraire, zones_arretes, dept_iti, uploaded_file)
@@ -1,5 +1,17 @@
 from subprocess import Popen
 
+# processus streamlit lancé, un seul pour toute la durée du serveur jupyter
+_processus = None
+
 def load_jupyter_server_extension(nbapp):
     """serve the streamlit app"""
-    Popen(["streamlit", "hello" , "--browser.serverAddress=0.0.0.0", "--server.enableCORS=False"])
\ No newline at end of file
+    global _processus
+    # pas de nouveau serveur si celui déjà lancé tourne encore
+    if _processus is not None and _processus.poll() is None:
+        return
+    _processus = Popen(["streamlit", "run", "app.py",
+                        "--server.headless=true",
+                        "--browser.gatherUsageStats=false",
+                        "--server.enableCORS=false",
+                        "--server.enableXsrfProtection=false",
+                        "--server.address=0.0.0.0"])